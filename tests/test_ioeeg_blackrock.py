@@ -1,4 +1,4 @@
-from numpy import isnan
+from numpy import array_equal, concatenate, isnan
 from pytest import raises
 from wonambi import Dataset
 
@@ -26,6 +26,31 @@ def test_blackrock_ns4_02():
     assert isnan(data.data[0][0, -10:]).all()
 
 
+def test_blackrock_ns4_03():
+    d = Dataset(ns4_file)
+    data = d.read_data(begsam=100, endsam=200)
+    data_0 = d.read_data(begsam=100, endsam=150)
+    data_1 = d.read_data(begsam=150, endsam=200)
+    assert array_equal(data.data[0],
+                       concatenate((data_0.data[0], data_1.data[0]), axis=1))
+
+
+def test_blackrock_ns4_04(tmp_path):
+    d = Dataset(ns4_file)
+    N_SMP = d.header['n_samples']
+
+    truncated_file = tmp_path / ns4_file.name
+    truncated_file.write_bytes(ns4_file.read_bytes()[:-1001])
+    d_trunc = Dataset(truncated_file)
+    N_TRUNC = d_trunc.header['n_samples']
+    assert N_TRUNC < N_SMP
+
+    data = d.read_data(begsam=N_TRUNC - 10, endsam=N_TRUNC)
+    data_trunc = d_trunc.read_data(begsam=N_TRUNC - 10, endsam=N_TRUNC + 10)
+    assert array_equal(data.data[0], data_trunc.data[0][:, :10])
+    assert isnan(data_trunc.data[0][:, -10:]).all()
+
+
 def test_blackrock_markers_00():
     d = Dataset(ns2_file)
     markers = d.read_markers()
@@ -1,7 +1,8 @@
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_array_equal
 from pytest import raises
 
 from wonambi import Dataset
+from wonambi.ioeeg.ktlx import ENT_NOTE_HDR, _iter_notes, _read_packet
 
 from .paths import ktlx_file
 
@@ -29,3 +30,35 @@ def test_xltek_videos():
     assert len(videos) == 2
     assert v_beg == 58.410209
     assert v_end == 37.177808
+
+
+def test_xltek_packet():
+    """Three channels, with one-byte deltas, two-byte deltas and absolute
+    values (two-byte delta of 0xffff, followed by the int32 value)."""
+    packet = bytes.fromhex(
+        '00 07 ffff ffff ffff e8030000 fdffffff 01000000'  # abs 1000, -3, 1
+        '00 02 fe e803 ff'  # -2, +1000 (wide), -1
+        '00 05 ffff 02 d4fe a0860100'  # abs 100000, +2, -300 (wide)
+        '00 00 ff007f'  # -1, 0, +127
+        '00 07 0200 ffff ffff fbffffff 70110100'  # +2, abs -5, abs 70000
+        '01 00 010101'  # +1, +1, +1 (with event)
+        )
+    layouts = {}
+    dat = _read_packet(packet, 0, 6, 3, 0xffff, layouts)
+
+    assert_array_equal(dat, [[1000, -3, 1],
+                             [998, 997, 0],
+                             [100000, 999, -300],
+                             [99999, 999, -173],
+                             [100001, -5, 70000],
+                             [100002, -4, 70001]])
+    assert len(layouts) == 4
+
+    dat = _read_packet(packet, 0, 2, 3, 0xffff, layouts)
+    assert_array_equal(dat, [[1000, -3, 1], [998, 997, 0]])
+
+
+def test_xltek_notes_malformed():
+    ent = ENT_NOTE_HDR.pack(1, 0, 0, 0) + b'x' * 40
+    with raises(ValueError):
+        list(_iter_notes(ent))
@@ -1,12 +1,69 @@
+from types import SimpleNamespace
+
+from numpy import array_equal, exp, isnan, nansum
+from numpy.linalg import norm
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+
 from wonambi.attr import Surf, Channels
 from wonambi.source import Linear
+from wonambi.source.linear import calc_xyz2surf
 
 from .paths import (surf_path,
                     chan_path,
                     )
 
+
+def _random_surf_xyz():
+    rs = RandomState(0)
+    surf = SimpleNamespace(vert=rs.uniform(-60, 60, (500, 3)))
+    xyz = rs.uniform(-60, 60, (16, 3))
+    return surf, xyz
+
+
 def test_source_linear():
     surf = Surf(surf_path)
     channels = Channels(chan_path)
 
     Linear(surf, channels)
+
+
+def test_source_linear_cache(tmp_path):
+    surf, xyz = _random_surf_xyz()
+
+    xyz2surf = calc_xyz2surf(surf, xyz, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob('xyz2surf_*.npz'))) == 1
+
+    cached = calc_xyz2surf(surf, xyz, cache_dir=tmp_path)
+    assert array_equal(xyz2surf.toarray(), cached.toarray())
+
+    calc_xyz2surf(surf, xyz, exponent=2, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob('xyz2surf_*.npz'))) == 2
+
+
+def test_source_linear_dense():
+    """The sparse matrix is the same as the dense matrix, computed on all the
+    pairs of vertices and channels."""
+    surf, xyz = _random_surf_xyz()
+
+    for threshold, exponent, std in ((20, 1, None),
+                                     (20, 2, None),
+                                     (15, None, 10),
+                                     ):
+        dist = norm(surf.vert[:, None, :] - xyz[None, :, :], axis=2)
+        if exponent is not None:
+            dense = 1 / dist ** exponent
+            external_threshold_value = 1 / threshold ** exponent
+        else:
+            dense = exp(-.5 * dist ** 2 / std ** 2)
+            external_threshold_value = exp(-.5)
+        dense[dist > threshold] = float('nan')
+        sumval = nansum(dense, axis=1)
+        sumval[sumval < external_threshold_value] = float('nan')
+        dense /= sumval[:, None]
+        dense[isnan(dense)] = 0
+
+        xyz2surf = calc_xyz2surf(surf, xyz, threshold=threshold,
+                                 exponent=exponent, std=std)
+        assert_allclose(xyz2surf.toarray(), dense, rtol=1e-6, atol=1e-7)
+
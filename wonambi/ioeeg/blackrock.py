@@ -1,12 +1,14 @@
+from collections.abc import Sequence
 from datetime import datetime, timezone
+from functools import partial
 from logging import getLogger, NOTSET, WARNING, disable
-from os import SEEK_SET, SEEK_CUR, SEEK_END
-from os.path import splitext
-from struct import unpack
+from os import fstat
+from struct import Struct
 from pathlib import Path
 
-from numpy import (asarray, empty, expand_dims, fromfile, iinfo, NaN, ones,
-                   reshape, where)
+from numpy import (asarray, ascontiguousarray, char, cumsum, diff, dtype,
+                   empty, float64, frombuffer, iinfo, memmap, multiply, NaN,
+                   ndarray, ones, uint8, where)
 
 lg = getLogger(__name__)
 
@@ -14,6 +16,37 @@ BLACKROCK_FORMAT = 'int16'  # by definition
 blackrock_iinfo = iinfo(BLACKROCK_FORMAT)
 N_BYTES = int(blackrock_iinfo.bits / 8)
 
+UINT16 = Struct('<H')
+UINT32 = Struct('<I')
+DATETIME = Struct('<8H')  # year, month, weekday, day, hour, min, s, ms
+
+# fixed layouts of the headers (see NEV and NSx specifications)
+NEURALCD_BASIC_HDR = Struct('<bbI16s256siI8HI')  # 306 bytes
+NEURALCD_EXT_HDR = dtype([  # 66 bytes per channel
+    ('Type', 'S2'),
+    ('ElectrodeID', '<u2'),
+    ('Label', 'S16'),
+    ('ConnectorBank', 'u1'),
+    ('ConnectorPin', 'u1'),
+    ('MinDigiValue', '<i2'),
+    ('MaxDigiValue', '<i2'),
+    ('MinAnalogValue', '<i2'),
+    ('MaxAnalogValue', '<i2'),
+    ('AnalogUnits', 'S16'),
+    ('HighFreqCorner', '<u4'),
+    ('HighFreqOrder', '<u4'),
+    ('HighFilterType', '<u2'),
+    ('LowFreqCorner', '<u4'),
+    ('LowFreqOrder', '<u4'),
+    ('LowFilterType', '<u2'),
+    ])
+NEURALEV_BASIC_HDR = Struct('<8sbbHIIII8H32s256sI')  # 336 bytes
+NEUEVWAV = Struct('<HBBhHhhBB')  # after the 8-byte PacketID
+NEUEVFLT = Struct('<HIIHIIH')  # after the 8-byte PacketID
+NSX_DATA_HDR = Struct('<BII')  # Header (always 1), Timestamp, DataPoints
+# Timestamp, PacketID, Reason, (reserved), DigitalInput
+NEV_DIGITAL_PACKET = Struct('<IHBxH')
+
 
 class BlackRock:
     """Basic class to read the data.
@@ -25,13 +58,26 @@ class BlackRock:
 
     """
     def __init__(self, filename):
-        self.filename = Path(filename)
+        self.filename = filename
         self.markers = []
 
+    @property
+    def filename(self):
+        return self._filename
+
+    @filename.setter
+    def filename(self, filename):
+        self._filename = Path(filename)
+        self.nev_file = self._filename.with_suffix('.nev')
+
+        # the header and the data of the previous file are not valid
+        self._hdr = None
         self.BOData = None
+        self.sess_data = None
         self.sess_begin = None
         self.sess_end = None
         self.factor = None
+        self.read_nsx = None
 
     def return_hdr(self):
         """Return the header for further use.
@@ -57,7 +103,12 @@ class BlackRock:
         -----
         The implementation needs to be updated for NEURALSG
 
+        The header is only read the first time, the following calls return
+        the same values.
         """
+        if self._hdr is not None:
+            return self._hdr
+
         with open(self.filename, 'rb') as f:
             file_header = f.read(8)
 
@@ -73,17 +124,21 @@ class BlackRock:
 
             s_freq = orig['SamplingFreq']
             n_samples = sum(orig['DataPoints']) + sum(orig['Timestamps'])
-            chan_name = [x['Label'] for x in orig['ElectrodesInfo']]
+            ExtHdr = orig['ElectrodesInfo'].ExtHdr
+            chan_name = list(orig['ElectrodesInfo'].Label)
 
             # INFO to read the data
             self.BOData = orig['BOData']
             self.sess_begin, self.sess_end = _calc_sess_intervals(orig)
-            self.factor = _convert_factor(orig['ElectrodesInfo'])
+            self.factor = _convert_factor(ExtHdr)
+            self.sess_data = _memmap_nsx(self.filename, orig)
+            self.read_nsx = partial(_read_nsx, self.sess_data,
+                                    self.sess_begin, self.sess_end,
+                                    self.factor)
 
-            nev_file = splitext(self.filename)[0] + '.nev'
             try:
                 disable(WARNING)
-                nev_orig = _read_neuralev(nev_file)
+                nev_orig = _read_neuralev(self.nev_file)
                 disable(NOTSET)
             except FileNotFoundError:
                 pass
@@ -108,9 +163,10 @@ class BlackRock:
         subj_id = str()
         start_time = orig['DateTime']
 
-        return subj_id, start_time, s_freq, chan_name, n_samples, orig
+        self._hdr = subj_id, start_time, s_freq, chan_name, n_samples, orig
+        return self._hdr
 
-    def return_dat(self, chan, begsam, endsam):
+    def return_dat(self, chan, begsam, endsam, out_dtype=float64):
         """Return the data as 2D numpy.ndarray.
 
         Parameters
@@ -121,6 +177,9 @@ class BlackRock:
             index of the first sample
         endsam : int
             index of the last sample
+        out_dtype : numpy.dtype, optional
+            floating point type of the output (use float32 to halve the memory
+            needed for long recordings)
 
         Returns
         -------
@@ -128,14 +187,13 @@ class BlackRock:
             A 2d matrix, with dimension chan X samples
 
         """
-        ext = splitext(self.filename)[1]
-        if ext == '.nev':
+        if self.filename == self.nev_file:
             raise TypeError('NEV contains only header info, not data')
 
-        data = _read_nsx(self.filename, self.BOData, self.sess_begin,
-                         self.sess_end, self.factor, begsam, endsam)
+        if self._hdr is None:
+            self.return_hdr()
 
-        return data[chan, :]
+        return self.read_nsx(_as_slice(chan), begsam, endsam, out_dtype)
 
     def return_markers(self, trigger_bits=16, trigger_zero=True):
         """
@@ -146,9 +204,8 @@ class BlackRock:
         trigger_zero : bool, optional
             read the trigger zero or not
         """
-        nev_file = splitext(self.filename)[0] + '.nev'
         markers = _read_neuralev(
-            nev_file,
+            self.nev_file,
             read_markers=True,
             trigger_bits=16)
 
@@ -171,49 +228,87 @@ class BlackRock:
         return markers
 
 
-def _read_nsx(filename, BOData, sess_begin, sess_end, factor, begsam, endsam):
+def _memmap_nsx(filename, hdr):
+    """Map the data of each session of a NSx file, without reading it.
+
+    Parameters
+    ----------
+    filename : path to file
+        NSx file
+    hdr : dict
+        header, as returned by _read_neuralcd
+
+    Returns
+    -------
+    list of numpy.ndarray
+        for each session, int16 values with dimension samples X chan (that's
+        the order in which they are stored in the file)
+
+    Notes
+    -----
+    The file is mapped only once and each session is a view into it, so there
+    is only one open file and one mapping, however many pauses there are.
     """
+    n_chan = hdr['ChannelCount']
+    raw = memmap(filename, uint8, mode='r')
+    return [ndarray((DataPoints, n_chan), BLACKROCK_FORMAT, buffer=raw,
+                    offset=BOData)
+            for BOData, DataPoints in zip(hdr['BOData'], hdr['DataPoints'])]
+
+
+def _read_nsx(sess_data, sess_begin, sess_end, factor, chan, begsam, endsam,
+              out_dtype=float64):
+    """
+
+    Parameters
+    ----------
+    chan : int or list
+        index (indices) of the channels to read
 
     Notes
     -----
     Tested on NEURALCD
 
     It returns NaN if you select an interval outside of the data
+
+    The int16 values are scaled directly into the output array. If the
+    channels are a slice (consecutive channels, see _as_slice), there is no
+    intermediate copy of the data; any other list of channels is copied once
+    by numpy when it's selected. Only the pages of the file which contain the
+    requested samples are read from disk, and only the selected channels are
+    converted.
     """
-    n_chan = factor.shape[0]
+    factor = factor[chan].astype(out_dtype)[..., None]
 
-    dat = empty((n_chan, endsam - begsam))
-    dat.fill(NaN)
+    dat = empty(factor.shape[:-1] + (endsam - begsam, ), dtype=out_dtype)
 
     sess_to_read = where((begsam < sess_end) & (endsam > sess_begin))[0]
 
-    with open(filename, 'rb') as f:
-
-        for sess in sess_to_read:
-            begsam_sess = begsam - sess_begin[sess]
-            endsam_sess = endsam - sess_begin[sess]
-
-            begshift = 0
+    # if the interval is within one session, all the values get overwritten
+    if not (len(sess_to_read) == 1 and
+            sess_begin[sess_to_read[0]] <= begsam and
+            endsam <= sess_end[sess_to_read[0]]):
+        dat.fill(NaN)
 
-            if begsam_sess < 0:
-                begsam_sess = 0
-                begshift = sess_begin[sess] - begsam
+    for sess in sess_to_read:
+        begsam_sess = begsam - sess_begin[sess]
+        endsam_sess = endsam - sess_begin[sess]
 
-            if endsam_sess > (sess_end[sess] - sess_begin[sess]):
-                endsam_sess = (sess_end[sess] - sess_begin[sess])
+        begshift = 0
 
-            endshift = begshift + endsam_sess - begsam_sess
+        if begsam_sess < 0:
+            begsam_sess = 0
+            begshift = sess_begin[sess] - begsam
 
-            f.seek(BOData[sess], SEEK_SET)
-            f.seek(n_chan * N_BYTES * begsam_sess, SEEK_CUR)
+        if endsam_sess > (sess_end[sess] - sess_begin[sess]):
+            endsam_sess = (sess_end[sess] - sess_begin[sess])
 
-            n_sam = endsam_sess - begsam_sess
-            dat_in_file = fromfile(f, BLACKROCK_FORMAT, n_chan * n_sam)
+        endshift = begshift + endsam_sess - begsam_sess
 
-            dat[:, begshift:endshift] = reshape(dat_in_file, (n_chan, n_sam),
-                                                order='F')
+        multiply(sess_data[sess][begsam_sess:endsam_sess, chan].T, factor,
+                 out=dat[..., begshift:endshift])
 
-    return expand_dims(factor, 1) * dat
+    return dat
 
 
 def _read_neuralsg(filename):
@@ -226,22 +321,22 @@ def _read_neuralsg(filename):
 
         hdr['FileTypeID'] = f.read(8).decode('utf-8')
         hdr['FileSpec'] = '2.1'
-        hdr['SamplingLabel'] = _str(f.read(16).decode('utf-8'))
+        hdr['SamplingLabel'] = _str(f.read(16))
         hdr['TimeRes'] = 30000
-        hdr['SamplingFreq'] = int(hdr['TimeRes'] / unpack('<I', f.read(4))[0])
-        n_chan = unpack('<I', f.read(4))[0]
+        hdr['SamplingFreq'] = int(hdr['TimeRes'] / UINT32.unpack(f.read(4))[0])
+        n_chan = UINT32.unpack(f.read(4))[0]
         hdr['ChannelCount'] = n_chan
-        hdr['ChannelID'] = unpack('<' + 'I' * n_chan, f.read(4 * n_chan))
+        ChannelID = frombuffer(f.read(4 * n_chan), '<u4')
+        hdr['ChannelID'] = tuple(ChannelID.tolist())
 
         BOData = f.tell()
-        f.seek(0, SEEK_END)
-        EOData = f.tell()
+        EOData = fstat(f.fileno()).st_size
 
     # we read the time information from the corresponding NEV file
-    nev_filename = splitext(filename)[0] + '.nev'
+    nev_filename = Path(filename).with_suffix('.nev')
     with open(nev_filename, 'rb') as f:
         f.seek(28)
-        time = unpack('<' + 'H' * 8, f.read(16))
+        time = DATETIME.unpack(f.read(DATETIME.size))
 
     hdr['DateTime'] = datetime(time[0], time[1], time[3],
                                time[4], time[5], time[6], time[7] * 1000)
@@ -266,76 +361,32 @@ def _read_neuralcd(filename):
     with open(filename, 'rb') as f:
         hdr['FileTypeID'] = f.read(8).decode('utf-8')
 
-        BasicHdr = f.read(306)
-        filespec = unpack('bb', BasicHdr[0:2])
-        hdr['FileSpec'] = str(filespec[0]) + '.' + str(filespec[1])
-        hdr['HeaderBytes'] = unpack('<I', BasicHdr[2:6])[0]
-        hdr['SamplingLabel'] = _str(BasicHdr[6:22].decode('utf-8'))
-        hdr['Comment'] = _str(BasicHdr[22:278].decode('utf-8', 'ignore'))
-        hdr['TimeRes'] = unpack('<I', BasicHdr[282:286])[0]
-        hdr['SamplingFreq'] = int(hdr['TimeRes'] /
-                                  unpack('<i', BasicHdr[278:282])[0])
-        time = unpack('<' + 'H' * 8, BasicHdr[286:302])
+        BasicHdr = NEURALCD_BASIC_HDR.unpack(f.read(NEURALCD_BASIC_HDR.size))
+        hdr['FileSpec'] = str(BasicHdr[0]) + '.' + str(BasicHdr[1])
+        hdr['HeaderBytes'] = BasicHdr[2]
+        hdr['SamplingLabel'] = _str(BasicHdr[3])
+        hdr['Comment'] = _str(BasicHdr[4], 'ignore')
+        hdr['TimeRes'] = BasicHdr[6]
+        hdr['SamplingFreq'] = int(hdr['TimeRes'] / BasicHdr[5])
+        time = BasicHdr[7:15]
         lg.info('The date/time from the header is stored in UTC, which is stored in DateTimeUTC')
         hdr['DateTime'] = datetime(time[0], time[1], time[3], time[4], time[5],
                                    time[6], time[7] * 1000,
                                    tzinfo=timezone.utc)
-        hdr['ChannelCount'] = unpack('<I', BasicHdr[302:306])[0]
+        hdr['ChannelCount'] = BasicHdr[15]
 
-        ExtHdrLength = 66
-        readSize = hdr['ChannelCount'] * ExtHdrLength
-        ExtHdr = f.read(readSize)
+        readSize = hdr['ChannelCount'] * NEURALCD_EXT_HDR.itemsize
+        ExtHdr = frombuffer(f.read(readSize), dtype=NEURALCD_EXT_HDR)
+        assert (ExtHdr['Type'] == b'CC').all()
 
-        ElectrodesInfo = []
-        for idx in range(hdr['ChannelCount']):
-            i1 = idx * ExtHdrLength
-            elec = {}
-            i0, i1 = i1, i1 + 2
-            elec['Type'] = ExtHdr[i0:i1].decode('utf-8')
-            assert elec['Type'] == 'CC'
-            i0, i1 = i1, i1 + 2
-            elec['ElectrodeID'] = unpack('<H', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 16
-            elec['Label'] = _str(ExtHdr[i0:i1].decode('utf-8'))
-            i0, i1 = i1, i1 + 1
-            elec['ConnectorBank'] = chr(unpack('<B', ExtHdr[i0:i1])[0] +
-                                        ord('A') - 1)
-            i0, i1 = i1, i1 + 1
-            elec['ConnectorPin'] = unpack('<B', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 2
-            elec['MinDigiValue'] = unpack('<h', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 2
-            elec['MaxDigiValue'] = unpack('<h', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 2
-            elec['MinAnalogValue'] = unpack('<h', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 2
-            elec['MaxAnalogValue'] = unpack('<h', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 16
-            elec['AnalogUnits'] = _str(ExtHdr[i0:i1].decode('utf-8'))
-            i0, i1 = i1, i1 + 4
-            elec['HighFreqCorner'] = unpack('<I', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 4
-            elec['HighFreqOrder'] = unpack('<I', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 2
-            elec['HighFilterType'] = unpack('<H', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 4
-            elec['LowFreqCorner'] = unpack('<I', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 4
-            elec['LowFreqOrder'] = unpack('<I', ExtHdr[i0:i1])[0]
-            i0, i1 = i1, i1 + 2
-            elec['LowFilterType'] = unpack('<H', ExtHdr[i0:i1])[0]
-            ElectrodesInfo.append(elec)
-
-        hdr['ElectrodesInfo'] = ElectrodesInfo
-        hdr['ChannelID'] = [x['ElectrodeID'] for x in ElectrodesInfo]
+        hdr['ElectrodesInfo'] = _ElectrodesInfo(ExtHdr)
+        hdr['ChannelID'] = ExtHdr['ElectrodeID'].tolist()
 
-        EOexH = f.tell()
-        f.seek(0, SEEK_END)
-        EOF = f.tell()
-        f.seek(EOexH, SEEK_SET)
+        pos = f.tell()
+        EOF = fstat(f.fileno()).st_size
         n_chan = hdr['ChannelCount']
 
-        if f.tell() >= EOF:
+        if pos >= EOF:
             raise EOFError('File {0} does not seem to contain data '
                            '(size {1} B)'.format(filename, EOF))
 
@@ -344,16 +395,21 @@ def _read_neuralcd(filename):
         Timestamps = []
         DataPoints = []
 
-        while f.tell() < EOF and f.read(1) == b'\x01':
+        # the position of each packet follows from the previous DataPoints
+        while pos < EOF:
 
-            Timestamps.append(unpack('<I', f.read(4))[0])
+            f.seek(pos)
+            packet = f.read(NSX_DATA_HDR.size)
+            if len(packet) < NSX_DATA_HDR.size or packet[0] != 1:
+                break
+            _, Timestamp, DataPoint = NSX_DATA_HDR.unpack(packet)
 
-            DataPoint = unpack('<I', f.read(4))[0]
+            Timestamps.append(Timestamp)
             DataPoints.append(DataPoint)
 
-            BOData.append(f.tell())
-            f.seek(N_BYTES * DataPoint * n_chan, SEEK_CUR)
-            EOData.append(f.tell())
+            BOData.append(pos + NSX_DATA_HDR.size)
+            pos = BOData[-1] + N_BYTES * DataPoint * n_chan
+            EOData.append(pos)
 
         # the last datapoint does not get updated, so it remains 0
         if DataPoints[-1] == 0:
@@ -364,6 +420,13 @@ def _read_neuralcd(filename):
             # we back compute the last DataPoint
             DataPoints[-1] = int((EOData[-1] - BOData[-1]) / N_BYTES / n_chan)
 
+        # a truncated file holds fewer samples than the last packet declares
+        if EOData[-1] > EOF:
+            lg.warning('File {0} is truncated, the last packet is shorter '
+                       'than declared in its header'.format(filename))
+            DataPoints[-1] = (EOF - BOData[-1]) // (N_BYTES * n_chan)
+            EOData[-1] = BOData[-1] + N_BYTES * DataPoints[-1] * n_chan
+
         hdr['BOData'] = BOData
         hdr['EOData'] = EOData
         hdr['Timestamps'] = Timestamps  # sampled at 'TimeRes' Hz, ie 30000
@@ -407,44 +470,32 @@ def _read_neuralev(filename, read_markers=False, trigger_bits=16):
     hdr = {}
     with open(filename, 'rb') as f:
 
-        BasicHdr = f.read(336)
+        BasicHdr = NEURALEV_BASIC_HDR.unpack(f.read(NEURALEV_BASIC_HDR.size))
 
-        i1 = 8
-        hdr['FileTypeID'] = BasicHdr[:i1].decode('utf-8')
+        hdr['FileTypeID'] = BasicHdr[0].decode('utf-8')
         assert hdr['FileTypeID'] == 'NEURALEV'
-        i0, i1 = i1, i1 + 2
-        filespec = unpack('bb', BasicHdr[i0:i1])
-        hdr['FileSpec'] = str(filespec[0]) + '.' + str(filespec[1])
-        i0, i1 = i1, i1 + 2
-        hdr['Flags'] = unpack('<H', BasicHdr[i0:i1])[0]
-        i0, i1 = i1, i1 + 4
-        hdr['HeaderOffset'] = unpack('<I', BasicHdr[i0:i1])[0]
-        i0, i1 = i1, i1 + 4
-        hdr['PacketBytes'] = unpack('<I', BasicHdr[i0:i1])[0]
-        i0, i1 = i1, i1 + 4
-        hdr['TimeRes'] = unpack('<I', BasicHdr[i0:i1])[0]
-        i0, i1 = i1, i1 + 4
-        hdr['SampleRes'] = unpack('<I', BasicHdr[i0:i1])[0]
-        i0, i1 = i1, i1 + 16
-        time = unpack('<' + 'H' * 8, BasicHdr[i0:i1])
+        hdr['FileSpec'] = str(BasicHdr[1]) + '.' + str(BasicHdr[2])
+        hdr['Flags'] = BasicHdr[3]
+        hdr['HeaderOffset'] = BasicHdr[4]
+        hdr['PacketBytes'] = BasicHdr[5]
+        hdr['TimeRes'] = BasicHdr[6]
+        hdr['SampleRes'] = BasicHdr[7]
+        time = BasicHdr[8:16]
         lg.debug('DateTime is in local time with Central version <= 6.03'
                  ' and in UTC with Central version > 6.05')
         hdr['DateTime'] = datetime(time[0], time[1], time[3],
                                    time[4], time[5], time[6], time[7] * 1000)
 
-        i0, i1 = i1, i1 + 32
-        # hdr['Application'] = _str(BasicHdr[i0:i1].decode('utf-8'))
-        i0, i1 = i1, i1 + 256
-        hdr['Comment'] = _str(BasicHdr[i0:i1].decode('utf-8',
-                                                     errors='replace'))
-        i0, i1 = i1, i1 + 4
-        countExtHeader = unpack('<I', BasicHdr[i0:i1])[0]
+        # hdr['Application'] = BasicHdr[16]
+        hdr['Comment'] = _str(BasicHdr[17])
+        countExtHeader = BasicHdr[18]
 
         # you can read subject name from sif
 
         # Check data duration
-        f.seek(-hdr['PacketBytes'], SEEK_END)
-        hdr['DataDuration'] = unpack('<I', f.read(4))[0]
+        EOF = fstat(f.fileno()).st_size
+        f.seek(EOF - hdr['PacketBytes'])
+        hdr['DataDuration'] = UINT32.unpack(f.read(4))[0]
         hdr['DataDurationSec'] = hdr['DataDuration'] / hdr['SampleRes']
 
         # Read the Extended Header
@@ -459,63 +510,53 @@ def _read_neuralev(filename, read_markers=False, trigger_bits=16):
             PacketID = ExtendedHeader[:i1].decode('utf-8')
 
             if PacketID == 'NEUEVWAV':
+                (ElectrodeID, ConnectorBank, ConnectorPin, df,
+                 EnergyThreshold, HighThreshold, LowThreshold, Units,
+                 WaveformBytes) = NEUEVWAV.unpack_from(ExtendedHeader, i1)
+
                 elec = {}
-                i0, i1 = i1, i1 + 2
-                elec['ElectrodeID'] = unpack('<H', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 1
-                elec['ConnectorBank'] = chr(ExtendedHeader[i0] + 64)
-                i0, i1 = i1, i1 + 1
-                elec['ConnectorPin'] = ExtendedHeader[i0]
-                i0, i1 = i1, i1 + 2
-                df = unpack('<h', ExtendedHeader[i0:i1])[0]
+                elec['ElectrodeID'] = ElectrodeID
+                elec['ConnectorBank'] = chr(ConnectorBank + 64)
+                elec['ConnectorPin'] = ConnectorPin
                 # This is a workaround for the DigitalFactor overflow
                 if df == 21516:
                     elec['DigitalFactor'] = 152592.547
                 else:
                     elec['DigitalFactor'] = df
 
-                i0, i1 = i1, i1 + 2
-                elec['EnergyThreshold'] = unpack('<H', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 2
-                elec['HighThreshold'] = unpack('<h', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 2
-                elec['LowThreshold'] = unpack('<h', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 1
-                elec['Units'] = ExtendedHeader[i0]
-                i0, i1 = i1, i1 + 1
-                elec['WaveformBytes'] = ExtendedHeader[i0]
+                elec['EnergyThreshold'] = EnergyThreshold
+                elec['HighThreshold'] = HighThreshold
+                elec['LowThreshold'] = LowThreshold
+                elec['Units'] = Units
+                elec['WaveformBytes'] = WaveformBytes
                 ElectrodesInfo.append(elec)
 
             elif PacketID == 'NEUEVLBL':
                 i0, i1 = i1, i1 + 2
-                ElectrodeID = unpack('<H', ExtendedHeader[i0:i1])[0] - 1
-                s = _str(ExtendedHeader[i1:].decode('utf-8'))
+                ElectrodeID = UINT16.unpack_from(ExtendedHeader, i0)[0] - 1
+                s = _str(ExtendedHeader[i1:])
                 ElectrodesInfo[ElectrodeID]['ElectrodeLabel'] = s
 
             elif PacketID == 'NEUEVFLT':
+                (ElectrodeID, HighFreqCorner, HighFreqOrder, HighFilterType,
+                 LowFreqCorner, LowFreqOrder, LowFilterType,
+                 ) = NEUEVFLT.unpack_from(ExtendedHeader, i1)
+
                 elec = {}
-                i0, i1 = i1, i1 + 2
-                ElectrodeID = unpack('<H', ExtendedHeader[i0:i1])[0] - 1
-                i0, i1 = i1, i1 + 4
-                elec['HighFreqCorner'] = unpack('<I', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 4
-                elec['HighFreqOrder'] = unpack('<I', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 2
-                elec['HighFilterType'] = unpack('<H', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 4
-                elec['LowFreqCorner'] = unpack('<I', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 4
-                elec['LowFreqOrder'] = unpack('<I', ExtendedHeader[i0:i1])[0]
-                i0, i1 = i1, i1 + 2
-                elec['LowFilterType'] = unpack('<H', ExtendedHeader[i0:i1])[0]
-                ElectrodesInfo[ElectrodeID].update(elec)
+                elec['HighFreqCorner'] = HighFreqCorner
+                elec['HighFreqOrder'] = HighFreqOrder
+                elec['HighFilterType'] = HighFilterType
+                elec['LowFreqCorner'] = LowFreqCorner
+                elec['LowFreqOrder'] = LowFreqOrder
+                elec['LowFilterType'] = LowFilterType
+                ElectrodesInfo[ElectrodeID - 1].update(elec)
 
             elif PacketID == 'DIGLABEL':
                 # TODO: the order is not taken into account and probably wrong!
                 iolabel = {}
 
                 iolabel['mode'] = ExtendedHeader[24] + 1
-                s = _str(ExtendedHeader[8:25].decode('utf-8'))
+                s = _str(ExtendedHeader[8:25])
                 iolabel['label'] = s
                 IOLabels.append(iolabel)
 
@@ -525,27 +566,26 @@ def _read_neuralev(filename, read_markers=False, trigger_bits=16):
         hdr['ChannelID'] = [x['ElectrodeID'] for x in ElectrodesInfo]
 
         fExtendedHeader = f.tell()
-        fData = f.seek(0, SEEK_END)
-        countDataPacket = int((fData - fExtendedHeader) / hdr['PacketBytes'])
+        countDataPacket = int((EOF - fExtendedHeader) / hdr['PacketBytes'])
 
         markers = []
         if read_markers and countDataPacket:
 
-            f.seek(fExtendedHeader)
             x = f.read(countDataPacket * hdr['PacketBytes'])
 
             DigiValues = []
             for j in range(countDataPacket):
                 i = j * hdr['PacketBytes']
 
-                if trigger_bits == 16:
-                    tempDigiVals = unpack('<H', x[8 + i:10 + i])[0]
-                else:
-                    tempDigiVals = unpack('<H', x[8 + i:9 + i] + b'\x00')[0]
+                (timestamp, packetID, tempClassOrReason,
+                 tempDigiVals) = NEV_DIGITAL_PACKET.unpack_from(x, i)
+
+                if trigger_bits != 16:
+                    tempDigiVals &= 0xff  # only the first byte
 
-                val = {'timestamp': unpack('<I', x[0 + i:4 + i])[0],
-                       'packetID': unpack('<H', x[4 + i:6 + i])[0],
-                       'tempClassOrReason': unpack('<B', x[6 + i:7 + i])[0],
+                val = {'timestamp': timestamp,
+                       'packetID': packetID,
+                       'tempClassOrReason': tempClassOrReason,
                        'tempDigiVals': tempDigiVals}
 
                 DigiValues.append(val)
@@ -573,28 +613,124 @@ def _read_neuralev(filename, read_markers=False, trigger_bits=16):
         return hdr
 
 
-def _str(t_in):
-    t_out = []
-    for t in t_in:
-        if t == '\x00':
-            break
-        t_out.append(t)
-    return ''.join(t_out)
+class _ElectrodesInfo(Sequence):
+    """Information about each electrode of a NSx file, as a list of dicts.
+
+    Parameters
+    ----------
+    ExtHdr : numpy.ndarray
+        structured array with the extended header of the NSx file (one item
+        per channel, see NEURALCD_EXT_HDR)
+
+    Notes
+    -----
+    The dict of one electrode is only created when it's accessed (files with
+    many channels have large headers, but often only a few fields are needed).
+    Because the dicts are created at each access, changing them has no effect.
+    """
+    def __init__(self, ExtHdr):
+        self.ExtHdr = ExtHdr
+        self.Label = _str_array(ExtHdr['Label']).tolist()
+        self.AnalogUnits = _str_array(ExtHdr['AnalogUnits']).tolist()
+
+    def __len__(self):
+        return len(self.ExtHdr)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        (Type, ElectrodeID, _, ConnectorBank, ConnectorPin,
+         MinDigiValue, MaxDigiValue, MinAnalogValue, MaxAnalogValue,
+         _, HighFreqCorner, HighFreqOrder, HighFilterType,
+         LowFreqCorner, LowFreqOrder, LowFilterType,
+         ) = self.ExtHdr[i].tolist()
+
+        elec = {}
+        elec['Type'] = Type.decode('utf-8')
+        elec['ElectrodeID'] = ElectrodeID
+        elec['Label'] = self.Label[i]
+        elec['ConnectorBank'] = chr(ConnectorBank + ord('A') - 1)
+        elec['ConnectorPin'] = ConnectorPin
+        elec['MinDigiValue'] = MinDigiValue
+        elec['MaxDigiValue'] = MaxDigiValue
+        elec['MinAnalogValue'] = MinAnalogValue
+        elec['MaxAnalogValue'] = MaxAnalogValue
+        elec['AnalogUnits'] = self.AnalogUnits[i]
+        elec['HighFreqCorner'] = HighFreqCorner
+        elec['HighFreqOrder'] = HighFreqOrder
+        elec['HighFilterType'] = HighFilterType
+        elec['LowFreqCorner'] = LowFreqCorner
+        elec['LowFreqOrder'] = LowFreqOrder
+        elec['LowFilterType'] = LowFilterType
+        return elec
+
+
+def _str(b_in, errors='replace'):
+    """Decode a null-terminated string (the bytes after the first null are
+    ignored)."""
+    return b_in.split(b'\x00', 1)[0].decode('utf-8', errors)
+
+
+def _str_array(b_in, errors='replace'):
+    """Decode an array of null-terminated strings at once (same as _str)."""
+    b = ascontiguousarray(b_in).view(uint8).reshape(len(b_in), b_in.itemsize)
+    b = b * (cumsum(b == 0, axis=1) == 0)  # remove what follows the null
+    return char.decode(b.view(b_in.dtype).ravel(), 'utf-8', errors)
 
 
 def _convert_factor(ElectrodesInfo):
+    """Compute the factor to convert digital values into analog values.
 
-    factor = []
-    for elec in ElectrodesInfo:
+    Parameters
+    ----------
+    ElectrodesInfo : list of dict or numpy.ndarray
+        information about each electrode, either as dicts or as the structured
+        array of the NSx extended header (NEURALCD_EXT_HDR)
+
+    Returns
+    -------
+    numpy.ndarray
+        conversion factor for each electrode
+    """
+    values = {}
+    for field in ('MinDigiValue', 'MaxDigiValue', 'MinAnalogValue',
+                  'MaxAnalogValue'):
+        if isinstance(ElectrodesInfo, ndarray):
+            values[field] = ElectrodesInfo[field].astype(float64)
+        else:
+            values[field] = asarray([elec[field] for elec in ElectrodesInfo],
+                                    dtype=float64)
+
+    # have to be equal, so it's simple to calculate conversion factor
+    assert (values['MaxDigiValue'] == -values['MinDigiValue']).all()
+    assert (values['MaxAnalogValue'] == -values['MinAnalogValue']).all()
+
+    return ((values['MaxAnalogValue'] - values['MinAnalogValue']) /
+            (values['MaxDigiValue'] - values['MinDigiValue']))
 
-        # have to be equal, so it's simple to calculate conversion factor
-        assert elec['MaxDigiValue'] == -elec['MinDigiValue']
-        assert elec['MaxAnalogValue'] == -elec['MinAnalogValue']
 
-        factor.append((elec['MaxAnalogValue'] - elec['MinAnalogValue']) /
-                      (elec['MaxDigiValue'] - elec['MinDigiValue']))
+def _as_slice(chan):
+    """Convert a list of consecutive channel indices into a slice, so that
+    numpy returns views instead of copies when selecting channels.
+
+    Parameters
+    ----------
+    chan : int or list
+        index (indices) of the channels
+
+    Returns
+    -------
+    int or list or slice
+        slice if the indices are increasing by one, otherwise chan unchanged
+    """
+    if isinstance(chan, (list, tuple, ndarray)) and len(chan) > 0:
+        idx = asarray(chan)
+        if (idx.dtype.kind in 'iu' and idx.ndim == 1 and idx[0] >= 0 and
+                (diff(idx) == 1).all()):
+            return slice(int(idx[0]), int(idx[-1]) + 1)
 
-    return asarray(factor)
+    return chan
 
 
 def _calc_sess_intervals(hdr):
@@ -15,26 +15,39 @@ is not _000 but there is no extension, for backwards compatibility.
 This module contains functions to read each of the files, the files are called
 _read_EXT where EXT is one of the extensions.
 """
+from ast import literal_eval
 from binascii import hexlify
 from datetime import timedelta, datetime
 from logging import getLogger
 from math import ceil
+from mmap import mmap, ACCESS_READ, PAGESIZE
+try:
+    from mmap import MADV_WILLNEED
+except ImportError:  # not available on all platforms
+    MADV_WILLNEED = None
 from os.path import join
 from pathlib import Path
-from re import sub
-from struct import unpack
-from numpy import (array,
+from re import compile as re_compile
+from struct import Struct, unpack_from
+from numpy import (arange,
                    asarray,
                    concatenate,
+                   cumsum,
                    dtype,
                    empty,
-                   expand_dims,
+                   frombuffer,
                    fromfile,
                    int32,
+                   int64,
+                   maximum,
+                   multiply,
                    NaN,
                    ones,
-                   unpackbits,
+                   searchsorted,
+                   take_along_axis,
+                   timedelta64,
                    where,
+                   zeros,
                    )
 
 lg = getLogger(__name__)
@@ -47,6 +60,35 @@ HUNDREDS_OF_NANOSECONDS = 10000000
 
 START_TIME_TOL = 10
 
+# max number of delta masks whose layout is kept in memory for each file
+MAX_DELTA_LAYOUTS = 256
+
+# delta (read as unsigned) meaning that the absolute value follows, per schema
+# (schema 7 is not supported, see _read_erd)
+ABS_DELTA = {8: 0xffff,  # two bytes, only 2-byte deltas can have this
+             9: 0xffff,
+             }
+
+# to convert the notes in .ent into python literals
+ENT_LIST = re_compile(r'\(([A-Za-z0-9," ]*)\)')
+ENT_KEY = re_compile(r'(\{[\w"]*),')
+ENT_NUMBERS = re_compile(r'\(([0-9 ,-\.]*)\}')
+
+# notes by these users are generated automatically, so they are not markers
+SKIPPED_USERS = {'Persyst',
+                 '0CFEBE72-DA20-4b3a-A8AC-CDD41BFE2F0D',  # pcname
+                 'XLSpike - Intracranial',
+                 'XLEvent - Intracranial',
+                 }
+
+GENERIC_HDR = Struct('<16sHHiii80s80s80s80s')  # 352 bytes, in every file
+EEG_HDR = Struct('<dii')  # sample_freq, num_channels, deltabits
+HEADBOX_HDR = Struct('<4i4i40s10s10si')  # from byte 4464
+ENT_NOTE_HDR = Struct('<iiii')  # type, length, prev_length, unused
+STC_HDR = Struct('<ii12i')  # next_segment, final, padding
+VTC_ENTRY = Struct('<261s16sqq')  # mpg_file, location, start, end
+HDR_LENGTH = 4464 + HEADBOX_HDR.size + 2 * 2048  # up to frequency_factor
+
 
 def get_date_idx(time_of_interest, start_time, end_time):
     idx = None
@@ -69,9 +111,9 @@ def convert_sample_to_video_time(sample, orig_s_freq, sampleStamp,
         sample that you want to convert in time
     orig_s_freq : int
         sampling frequency (used as backup)
-    sampleStamp : list of int
+    sampleStamp : ndarray of int
         Sample number from start of study
-    sampleTime : list of datetime.datetime
+    sampleTime : ndarray of datetime64[us]
         File time representation of sampleStamp
 
     Returns
@@ -95,15 +137,15 @@ def convert_sample_to_video_time(sample, orig_s_freq, sampleStamp,
         s_freq = orig_s_freq
         id0 = len(sampleStamp) - 1
     else:
-        id0 = where(asarray(sampleStamp) <= sample)[0][-1]
-        id1 = where(asarray(sampleStamp) >= sample)[0][0]
+        id0 = searchsorted(sampleStamp, sample, side='right') - 1
+        id1 = searchsorted(sampleStamp, sample, side='left')
 
         if id0 == id1:
-            return sampleTime[id0]
+            return sampleTime[id0].item()
         s_freq = ((sampleStamp[id1] - sampleStamp[id0]) /
-                  (sampleTime[id1] - sampleTime[id0]).total_seconds())
+                  ((sampleTime[id1] - sampleTime[id0]) / timedelta64(1, 's')))
     time_diff = timedelta(seconds=(sample - sampleStamp[id0]) / s_freq)
-    return sampleTime[id0] + time_diff
+    return sampleTime[id0].item() + time_diff
 
 
 def _calculate_conversion(hdr):
@@ -250,6 +292,13 @@ def _filetime_to_dt(ft):
     return dt
 
 
+def _filetime_to_dt64(ft):
+    """Converts an array of Microsoft filetime numbers to datetime64[us]
+    (time zone-naive, but equivalent to UTC).
+    """
+    return ((ft - EPOCH_AS_FILETIME) // 10).astype('datetime64[us]')
+
+
 def _find_channels(note):
     """Find the channel names within a string.
 
@@ -284,7 +333,7 @@ def _find_start_time(hdr, s_freq):
     Parameters
     ----------
     hdr : dict
-        header with stc (and stamps) and erd
+        header with stc (and stamps and segment_name) and erd
     s_freq : int
         sampling frequency
 
@@ -308,10 +357,8 @@ def _find_start_time(hdr, s_freq):
     """
     start_time = hdr['stc']['creation_time']
 
-    for one_stamp in hdr['stamps']:
-        if one_stamp['segment_name'].decode() == hdr['erd']['filename']:
-            offset = one_stamp['start_stamp']
-            break
+    i_stamp = hdr['segment_name'].index(hdr['erd']['filename'])
+    offset = hdr['stamps'][i_stamp]['start_stamp']
 
     erd_time = (hdr['erd']['creation_time'] -
                 timedelta(seconds=offset / s_freq)).replace(microsecond=0)
@@ -326,12 +373,7 @@ def _find_start_time(hdr, s_freq):
 
 
 def _make_str(t_in):
-    t_out = []
-    for t in t_in:
-        if t == b'\x00':
-            break
-        t_out.append(t.decode('utf-8'))
-    return ''.join(t_out)
+    return t_in.partition(b'\x00')[0].decode('utf-8', errors='replace')
 
 
 def _read_eeg(eeg_file):
@@ -354,14 +396,16 @@ def _read_ent(ent_file):
     """Read notes stored in .ent file.
 
     This is a basic implementation, that relies on turning the information in
-    the string in the dict format, and then evaluate it. It's not very flexible
+    the string in the dict format, and then evaluate it (as a literal, so that
+    no code in the notes is ever executed). It's not very flexible
     and it might not read some notes, but it's fast. I could not implement a
     nice, recursive approach.
 
     Returns
     -------
-    allnote : a list of dict
-        where each dict contains keys such as:
+    generator of dict
+        the notes are parsed one by one while iterating. Each dict contains
+        keys such as:
           - type
           - length : length of the note in B,
           - prev_length : length of the previous note in B,
@@ -377,51 +421,71 @@ def _read_ent(ent_file):
     electrodes (I think they called it "montage") cannot be parsed, because
     it's too complicated. If it cannot be converted into a dict, the whole
     string is passed as value.
+
+    The file is read when calling this function (so that errors about the file
+    are raised immediately), but the notes are parsed only when needed.
     """
     with ent_file.open('rb') as f:
         f.seek(352)  # end of header
+        ent = f.read()
 
-        note_hdr_length = 16
+    return _iter_notes(ent)
 
-        allnote = []
-        while True:
-            note = {}
-            note['type'], = unpack('<i', f.read(4))
-            note['length'], = unpack('<i', f.read(4))
-            note['prev_length'], = unpack('<i', f.read(4))
-            note['unused'], = unpack('<i', f.read(4))
-            if not note['type']:
-                break
-            s = f.read(note['length'] - note_hdr_length)
-            s = s[:-2]  # it ends with one empty byte
-            s = s.decode('utf-8', errors='replace')
-            s1 = s.replace('\n', ' ')
-            s1 = s1.replace('\\xd ', '')
-            s1 = s1.replace('(.', '{')
-            s1 = sub(r'\(([A-Za-z0-9," ]*)\)', r'[\1]', s1)
-            s1 = s1.replace(')', '}')
-            # s1 = s1.replace('",', '" :')
-            s1 = sub(r'(\{[\w"]*),', r'\1 :', s1)
-            s1 = s1.replace('{"', '"')
-            s1 = s1.replace('},', ',')
-            s1 = s1.replace('}}', '}')
-            s1 = sub(r'\(([0-9 ,-\.]*)\}', r'[\1]', s1)
-            try:
-                note['value'] = eval(s1)
-            except:
-                note['value'] = s
-            allnote.append(note)
-    return allnote
+
+def _iter_notes(ent):
+    """Parse the notes of the .ent file one at the time (see _read_ent).
+
+    Parameters
+    ----------
+    ent : bytes
+        content of the .ent file after the header
+
+    Yields
+    ------
+    dict
+        one note
+    """
+    pos = 0
+    while True:
+        note = {}
+        (note['type'], note['length'], note['prev_length'],
+         note['unused']) = ENT_NOTE_HDR.unpack_from(ent, pos)
+        if not note['type']:
+            break
+        if note['length'] < ENT_NOTE_HDR.size:
+            raise ValueError('at pos ' + str(pos) + ', length of the note ' +
+                             'shorter than its header: ' +
+                             str(note['length']))
+        s = ent[pos + ENT_NOTE_HDR.size:pos + note['length']]
+        pos += note['length']
+        s = s[:-2]  # it ends with one empty byte
+        s = s.decode('utf-8', errors='replace')
+        s1 = s.replace('\n', ' ')
+        s1 = s1.replace('\\xd ', '')
+        s1 = s1.replace('(.', '{')
+        s1 = ENT_LIST.sub(r'[\1]', s1)
+        s1 = s1.replace(')', '}')
+        # s1 = s1.replace('",', '" :')
+        s1 = ENT_KEY.sub(r'\1 :', s1)
+        s1 = s1.replace('{"', '"')
+        s1 = s1.replace('},', ',')
+        s1 = s1.replace('}}', '}')
+        s1 = ENT_NUMBERS.sub(r'[\1]', s1)
+        try:
+            note['value'] = literal_eval(s1)
+        except:
+            note['value'] = s
+        yield note
 
 
-def _read_packet(f, pos, n_smp, n_allchan, abs_delta):
+def _read_packet(buf, pos, n_smp, n_allchan, abs_delta, layouts):
     """
     Read a packet of compressed data
 
     Parameters
     ----------
-    f : instance of opened file
-        erd file
+    buf : instance of mmap
+        erd file, mapped in memory
     pos : int
         index of the start of the packet in the file (in bytes from beginning
         of the file)
@@ -429,15 +493,19 @@ def _read_packet(f, pos, n_smp, n_allchan, abs_delta):
         number of samples to read
     n_allchan : int
         number of channels (we should specify if shorted or not)
-    abs_delta: byte
-        if the delta has this value, it means that you should read the absolute
-        value at the end of packet. If schema is 7, the length is 1; if schema
-        is 8 or 9, the length is 2.
+    abs_delta: int
+        if the delta has this value (read as unsigned), it means that you
+        should read the absolute value at the end of packet.
+    layouts : dict
+        how to read the deltas for each delta mask (see _delta_layout). It's
+        filled in place (up to MAX_DELTA_LAYOUTS masks), so it can be shared
+        by all the packets of a file.
 
     Returns
     -------
     ndarray
-        data read in the packet up to n_smp.
+        data read in the packet up to n_smp (samples x channels, the same
+        layout as in the file).
 
     Notes
     -----
@@ -446,47 +514,86 @@ def _read_packet(f, pos, n_smp, n_allchan, abs_delta):
 
     TODO: implement schema 7, which is slightly different, but I don't remember
     where exactly.
-    """
-    if len(abs_delta) == 1:  # schema 7
-        abs_delta = unpack('b', abs_delta)[0]
-    else:  # schema 8, 9
-        abs_delta = unpack('h', abs_delta)[0]
 
-    l_deltamask = int(ceil(n_allchan / BITS_IN_BYTE))
-    dat = empty((n_allchan, n_smp), dtype=int32)
-    f.seek(pos)
+    The loop over samples only reads the deltas (which are needed to know where
+    the next sample starts). The deltas are then converted into values for all
+    the samples at once with a cumulative sum, which restarts at each absolute
+    value.
+    """
+    l_smp_hdr = 1 + int(ceil(n_allchan / BITS_IN_BYTE))  # event byte + mask
+    delta = empty((n_smp, n_allchan), dtype=int64)
+    is_wide = empty((n_smp, n_allchan), dtype=bool)
+    absval = []
 
     for i_smp in range(n_smp):
-        eventbite = f.read(1)
+        smp_hdr = buf[pos:pos + l_smp_hdr]
+        pos += l_smp_hdr
+        eventbite = smp_hdr[:1]
 
-        try:
-            assert eventbite in (b'\x00', b'\x01')
-        except:
+        if eventbite not in (b'\x00', b'\x01'):
             raise Exception('at pos ' + str(i_smp) +
                             ', eventbite (should be x00 or x01): ' +
                             str(eventbite))
 
-        byte_deltamask = unpack('<' + 'B' * l_deltamask, f.read(l_deltamask))
-        deltamask = unpackbits(array(byte_deltamask[::-1], dtype ='uint8'))
-        deltamask = deltamask[:-n_allchan-1:-1]
+        byte_deltamask = smp_hdr[1:]
+        try:
+            delta_struct, wide = layouts[byte_deltamask]
+        except KeyError:
+            delta_struct, wide = _delta_layout(byte_deltamask, n_allchan)
+            if len(layouts) < MAX_DELTA_LAYOUTS:
+                layouts[byte_deltamask] = delta_struct, wide
+
+        relval = delta_struct.unpack_from(buf, pos)
+        pos += delta_struct.size
+        delta[i_smp] = relval
+        is_wide[i_smp] = wide
+
+        n_abs = relval.count(abs_delta)
+        if n_abs:
+            absval.extend(unpack_from('<' + 'i' * n_abs, buf, pos))
+            pos += 4 * n_abs
+
+    read_abs = is_wide & (delta == abs_delta)
+
+    # from unsigned to signed values
+    delta -= where(is_wide, (delta >= 2 ** 15) * 2 ** 16,
+                   (delta >= 2 ** 7) * 2 ** 8)
+    delta[read_abs] = 0
+    dat = cumsum(delta, axis=0)
+
+    if absval:
+        # offset to apply from each absolute value until the next one
+        offset = zeros((n_smp, n_allchan), dtype=int64)
+        offset[read_abs] = asarray(absval) - dat[read_abs]
+        i_abs = where(read_abs, arange(n_smp)[:, None], 0)
+        maximum.accumulate(i_abs, axis=0, out=i_abs)
+        dat += take_along_axis(offset, i_abs, axis=0)
 
-        n_bytes = int(deltamask.sum()) + deltamask.shape[0]
+    return dat
 
-        deltamask = deltamask.astype('bool')
-        # numpy has a weird way of handling string/bytes.
-        # We create a byte representation, because then tostring() works fine
-        delta_dtype = empty(n_allchan, dtype='a1')
-        delta_dtype[deltamask] = 'h'
-        delta_dtype[~deltamask] = 'b'
-        relval = array(unpack('<' + delta_dtype.tostring().decode(),
-                              f.read(n_bytes)))
 
-        read_abs = (delta_dtype == b'h') & (relval == abs_delta)
+def _delta_layout(byte_deltamask, n_allchan):
+    """Prepare how to read the deltas of one sample, based on the delta mask.
 
-        dat[~read_abs, i_smp] = dat[~read_abs, i_smp - 1] + relval[~read_abs]
-        dat[read_abs, i_smp] = fromfile(f, 'i', count=read_abs.sum())
+    Parameters
+    ----------
+    byte_deltamask : bytes
+        the deltamask in the file (one bit per channel, 1 means that the delta
+        is stored in 2 bytes, 0 in one byte)
+    n_allchan : int
+        number of channels
 
-    return dat
+    Returns
+    -------
+    instance of Struct
+        to read the deltas of all the channels (as unsigned values)
+    ndarray of bool
+        whether the delta of each channel is stored in 2 bytes
+    """
+    deltamask = int.from_bytes(byte_deltamask, 'little')
+    wide = [(deltamask >> i_c) & 1 for i_c in range(n_allchan)]
+    delta_struct = Struct('<' + ''.join('H' if x else 'B' for x in wide))
+    return delta_struct, asarray(wide, dtype=bool)
 
 
 def _read_erd(erd_file, begsam, endsam):
@@ -549,33 +656,49 @@ def _read_erd(erd_file, begsam, endsam):
     hdr = _read_hdr_file(erd_file)
     n_allchan = hdr['num_channels']
     shorted = hdr['shorted']  # does this exist for Schema 7 at all?
-    n_shorted = sum(shorted)
+    n_shorted = shorted.sum()
     if n_shorted > 0:
         raise NotImplementedError('shorted channels not tested yet')
 
     if hdr['file_schema'] in (7,):
-        abs_delta = b'\x80'  # one byte: 10000000
         raise NotImplementedError('schema 7 not tested yet')
 
-    if hdr['file_schema'] in (8, 9):
-        abs_delta = b'\xff\xff'
+    try:
+        abs_delta = ABS_DELTA[hdr['file_schema']]
+    except KeyError:
+        raise NotImplementedError('Reading data not implemented for ' +
+                                  'file_schema ' + str(hdr['file_schema']))
 
     n_smp = endsam - begsam
-    data = empty((n_allchan, n_smp))
-    data.fill(NaN)
+    # samples x channels, as in the file, transposed only at the end
+    output = empty((n_smp, n_allchan))
 
     # it includes the sample in both cases
     etc = _read_etc(erd_file.with_suffix('.etc'))
     all_beg = etc['samplestamp']
     all_end = etc['samplestamp'] + etc['sample_span'] - 1
 
-    try:
-        begrec = where((all_end >= begsam))[0][0]
-        endrec = where((all_beg < endsam))[0][-1]
-    except IndexError:
-        return data
+    begrec = searchsorted(all_end, begsam)
+    endrec = searchsorted(all_beg, endsam) - 1
+    if begrec == len(etc) or endrec < 0:
+        output.fill(NaN)
+        return output.T
+
+    # keep the integer values, convert them to float only at the end
+    data = empty((n_smp, n_allchan), dtype=int32)
+    is_read = zeros(n_smp, dtype=bool)
+    layouts = {}
+    with erd_file.open('rb') as f, mmap(f.fileno(), 0,
+                                        access=ACCESS_READ) as buf:
+        if MADV_WILLNEED is not None:
+            # let the OS read ahead all the packets at once
+            begpos = int(etc['offset'][begrec]) // PAGESIZE * PAGESIZE
+            if endrec + 1 < len(etc):
+                endpos = int(etc['offset'][endrec + 1])
+            else:
+                endpos = len(buf)
+            buf.madvise(MADV_WILLNEED, begpos, endpos - begpos)
 
-    with erd_file.open('rb') as f:
         for rec in range(begrec, endrec + 1):
 
             # [begpos_rec, endpos_rec]
@@ -589,22 +712,20 @@ def _read_erd(erd_file, begsam, endsam):
             d1 = begpos_rec + all_beg[rec] - begsam
             d2 = endpos_rec + all_beg[rec] - begsam
 
-            dat = _read_packet(f, etc['offset'][rec], endpos_rec, n_allchan,
-                               abs_delta)
-            data[:, d1:d2] = dat[:, begpos_rec:endpos_rec]
+            dat = _read_packet(buf, int(etc['offset'][rec]), endpos_rec,
+                               n_allchan, abs_delta, layouts)
+            data[d1:d2] = dat[begpos_rec:endpos_rec]
+            is_read[d1:d2] = True
 
+    factor = _calculate_conversion(hdr)
+    multiply(factor, data, out=output)
 
-    # fill up the output data, put NaN for shorted channels
+    # put NaN where there is no data and for shorted channels
+    output[~is_read] = NaN
     if n_shorted > 0:
-        full_channels = where(asarray([x == 0 for x in shorted]))[0]
-        output = empty((n_allchan, n_smp))
-        output.fill(NaN)
-        output[full_channels, :] = data
-    else:
-        output = data
+        output[:, shorted != 0] = NaN
 
-    factor = _calculate_conversion(hdr)
-    return expand_dims(factor, 1) * output
+    return output.T
 
 
 def _read_etc(etc_file):
@@ -628,9 +749,9 @@ def _read_snc(snc_file):
 
     Returns
     -------
-    sampleStamp : list of int
+    sampleStamp : ndarray of int
         Sample number from start of study
-    sampleTime : list of datetime.datetime
+    sampleTime : ndarray of datetime64[us]
         File time representation of sampleStamp
 
     Notes
@@ -660,7 +781,7 @@ def _read_snc(snc_file):
         snc_raw = fromfile(f, dtype=snc_raw_dtype)
 
     sampleStamp = snc_raw['sampleStamp']
-    sampleTime = asarray([_filetime_to_dt(x) for x in snc_raw['sampleTime']])
+    sampleTime = _filetime_to_dt64(snc_raw['sampleTime'])
 
     return sampleStamp, sampleTime
 
@@ -713,9 +834,9 @@ def _read_stc(stc_file):
 
     with stc_file.open('rb') as f:
         f.seek(352)  # end of header
-        hdr['next_segment'] = unpack('<i', f.read(4))[0]
-        hdr['final'] = unpack('<i', f.read(4))[0]
-        hdr['padding'] = unpack('<' + 'i' * 12, f.read(48))
+        stc_hdr = STC_HDR.unpack(f.read(STC_HDR.size))
+        hdr['next_segment'], hdr['final'] = stc_hdr[:2]
+        hdr['padding'] = stc_hdr[2:]
 
         stamps = fromfile(f, dtype=stc_dtype)
 
@@ -746,23 +867,16 @@ def _read_vtc(vtc_file):
     hdr['file_guid'] = hexlify(filebytes[:16])
     # not sure about the 4 Bytes inbetween
 
-    i = 20
+    correct = b'\xff\xfe\xf8^\xfc\xdc\xe5D\x8f\xae\x19\xf5\xd6"\xb6\xd4'
     mpg_file = []
     start_time = []
     end_time = []
-    while i < len(filebytes):
-        mpg_file.append(_make_str(unpack('c' * 261, filebytes[i:i + 261])))
-        i += 261
-        Location = filebytes[i:i + 16]
-        correct = b'\xff\xfe\xf8^\xfc\xdc\xe5D\x8f\xae\x19\xf5\xd6"\xb6\xd4'
+    for one_mpg, Location, one_start, one_end in VTC_ENTRY.iter_unpack(
+            filebytes[20:]):
         assert Location == correct
-        i += 16
-        start_time.append(_filetime_to_dt(unpack('<q',
-                                                 filebytes[i:(i + 8)])[0]))
-        i += 8
-        end_time.append(_filetime_to_dt(unpack('<q',
-                                               filebytes[i:(i + 8)])[0]))
-        i += 8
+        mpg_file.append(_make_str(one_mpg))
+        start_time.append(_filetime_to_dt(one_start))
+        end_time.append(_filetime_to_dt(one_end))
 
     return mpg_file, start_time, end_time
 
@@ -787,58 +901,61 @@ def _read_hdr_file(ktlx_file):
     GUID is correct, BUT little/big endian problems somewhere
     """
     with ktlx_file.open('rb') as f:
+        buf = f.read(HDR_LENGTH)
 
-        hdr = {}
-        assert f.tell() == 0
-
-        hdr['file_guid'] = hexlify(f.read(16))
-        hdr['file_schema'], = unpack('<H', f.read(2))
-        if not hdr['file_schema'] in (1, 3, 7, 8, 9):
-            raise NotImplementedError('Reading header not implemented for ' +
-                                      'file_schema ' + str(hdr['file_schema']))
-
-        hdr['base_schema'], = unpack('<H', f.read(2))
-        if not hdr['base_schema'] == 1:  # p.3: base_schema 0 is rare, I think
-            raise NotImplementedError('Reading header not implemented for ' +
-                                      'base_schema ' + str(hdr['base_schema']))
-
-        hdr['creation_time'] = datetime.fromtimestamp(unpack('<i',
-                                                             f.read(4))[0])
-        hdr['patient_id'], = unpack('<i', f.read(4))
-        hdr['study_id'], = unpack('<i', f.read(4))
-        hdr['pat_last_name'] = _make_str(unpack('c' * 80, f.read(80)))
-        hdr['pat_first_name'] = _make_str(unpack('c' * 80, f.read(80)))
-        hdr['pat_middle_name'] = _make_str(unpack('c' * 80, f.read(80)))
-        hdr['patient_id'] = _make_str(unpack('c' * 80, f.read(80)))
-        assert f.tell() == 352
-
-        if hdr['file_schema'] >= 7:
-            hdr['sample_freq'], = unpack('<d', f.read(8))
-            n_chan, = unpack('<i', f.read(4))
-            hdr['num_channels'] = n_chan
-            hdr['deltabits'], = unpack('<i', f.read(4))
-            hdr['phys_chan'] = unpack('<' + 'i' * hdr['num_channels'],
-                                      f.read(hdr['num_channels'] * 4))
-
-            f.seek(4464)
-            hdr['headbox_type'] = unpack('<' + 'i' * 4, f.read(16))
-            hdr['headbox_sn'] = unpack('<' + 'i' * 4, f.read(16))
-            hdr['headbox_sw_version'] = _make_str(unpack('c' * 40, f.read(40)))
-            hdr['dsp_hw_version'] = _make_str(unpack('c' * 10, f.read(10)))
-            hdr['dsp_sw_version'] = _make_str(unpack('c' * 10, f.read(10)))
-            hdr['discardbits'], = unpack('<i', f.read(4))
-
-        if hdr['file_schema'] >= 8:
-            hdr['shorted'] = unpack('<' + 'h' * 1024, f.read(2048))[:n_chan]
-            hdr['frequency_factor'] = unpack('<' + 'h' * 1024,
-                                             f.read(2048))[:n_chan]
+    (file_guid, file_schema, base_schema, creation_time, _,
+     study_id, pat_last_name, pat_first_name, pat_middle_name,
+     patient_id) = GENERIC_HDR.unpack_from(buf)
+
+    hdr = {}
+    hdr['file_guid'] = hexlify(file_guid)
+    hdr['file_schema'] = file_schema
+    if not file_schema in (1, 3, 7, 8, 9):
+        raise NotImplementedError('Reading header not implemented for ' +
+                                  'file_schema ' + str(file_schema))
+
+    hdr['base_schema'] = base_schema
+    if not base_schema == 1:  # p.3: base_schema 0 is rare, I think
+        raise NotImplementedError('Reading header not implemented for ' +
+                                  'base_schema ' + str(base_schema))
+
+    hdr['creation_time'] = datetime.fromtimestamp(creation_time)
+    hdr['study_id'] = study_id
+    hdr['pat_last_name'] = _make_str(pat_last_name)
+    hdr['pat_first_name'] = _make_str(pat_first_name)
+    hdr['pat_middle_name'] = _make_str(pat_middle_name)
+    hdr['patient_id'] = _make_str(patient_id)
+
+    if file_schema >= 7:
+        pos = GENERIC_HDR.size
+        hdr['sample_freq'], n_chan, hdr['deltabits'] = EEG_HDR.unpack_from(
+            buf, pos)
+        hdr['num_channels'] = n_chan
+        pos += EEG_HDR.size
+        hdr['phys_chan'] = frombuffer(buf, dtype='<i4', count=n_chan,
+                                      offset=pos)
+
+        headbox = HEADBOX_HDR.unpack_from(buf, 4464)
+        hdr['headbox_type'] = headbox[:4]
+        hdr['headbox_sn'] = headbox[4:8]
+        hdr['headbox_sw_version'] = _make_str(headbox[8])
+        hdr['dsp_hw_version'] = _make_str(headbox[9])
+        hdr['dsp_sw_version'] = _make_str(headbox[10])
+        hdr['discardbits'] = headbox[11]
+
+    if file_schema >= 8:
+        pos = 4464 + HEADBOX_HDR.size
+        hdr['shorted'] = frombuffer(buf, dtype='<i2', count=n_chan,
+                                    offset=pos)
+        hdr['frequency_factor'] = frombuffer(buf, dtype='<i2', count=n_chan,
+                                             offset=pos + 2048)
     return hdr
 
 
 class Ktlx():
     def __init__(self, ktlx_dir):
         lg.info('Reading ' + str(ktlx_dir))
-        self.filename = ktlx_dir
+        self.filename = Path(ktlx_dir)
         self._filename = None  # Path of dir and filename stem
         self._hdr = self._read_hdr_dir()
 
@@ -851,12 +968,13 @@ class Ktlx():
           - 'erd': header of .erd file
           - 'stc': general part of .stc file
           - 'stamps' : time stamp for each file
+          - 'segment_name' : name of each .erd file (list of str)
 
         Also, it adds the attribute
         _basename : Path
             the name of the files inside the directory
         """
-        foldername = Path(self.filename)
+        foldername = self.filename
         stc_file = foldername / (foldername.stem + '.stc')
 
         if stc_file.exists():
@@ -876,7 +994,12 @@ class Ktlx():
         # use .erd because it has extra info, such as sampling freq
         # try to read any possible ERD (in case one or two ERD are missing)
         # don't read very first erd because creation_time is slightly off
-        for erd_file in foldername.glob(self._filename.stem + '_*.erd'):
+        # the stem is not used as glob pattern, because it might contain [ ]
+        erd_prefix = self._filename.stem + '_'
+        for erd_file in foldername.iterdir():
+            if not (erd_file.suffix.lower() == '.erd' and
+                    erd_file.stem.startswith(erd_prefix)):
+                continue
             try:
                 hdr['erd'] = _read_hdr_file(erd_file)
                 # we need this to look up stc
@@ -889,6 +1012,9 @@ class Ktlx():
         stc = _read_stc(self._filename.with_suffix('.stc'))
 
         hdr['stc'], hdr['stamps'] = stc
+        # decode the names only once, they are used to find the .erd files
+        hdr['segment_name'] = [_make_str(x) for x in
+                               hdr['stamps']['segment_name']]
 
         return hdr
 
@@ -922,18 +1048,18 @@ class Ktlx():
         dat = empty((len(chan), endsam - begsam))
         dat.fill(NaN)
 
-        stc, all_stamp = _read_stc(self._filename.with_suffix('.stc'))
-
-        all_erd = all_stamp['segment_name'].astype('U')  # convert to str
+        all_stamp = self._hdr['stamps']
         all_beg = all_stamp['start_stamp']
         all_end = all_stamp['end_stamp']
 
-        try:
-            begrec = where((all_end >= begsam))[0][0]
-            endrec = where((all_beg < endsam))[0][-1]
-        except IndexError:
+        # segments are sorted, so look up the first and last one directly
+        begrec = searchsorted(all_end, begsam)
+        endrec = searchsorted(all_beg, endsam) - 1
+        if begrec == len(all_stamp) or endrec < 0:
             return dat
 
+        all_erd = self._hdr['segment_name']
+
         for rec in range(begrec, endrec + 1):
 
             begpos_rec = max(begsam, all_beg[rec])
@@ -944,7 +1070,7 @@ class Ktlx():
             d1 = begpos_rec - begsam
             d2 = endpos_rec - begsam
 
-            erd_file = (Path(self.filename) / all_erd[rec]).with_suffix('.erd')
+            erd_file = (self.filename / all_erd[rec]).with_suffix('.erd')
 
             try:
                 dat_rec = _read_erd(erd_file, begpos_rec, endpos_rec)
@@ -990,7 +1116,7 @@ class Ktlx():
             ent_file = self._filename.with_suffix('.ent')
             if not ent_file.exists():
                 ent_file = self._filename.with_suffix('.ent.old')
-            ent_notes = _read_ent(ent_file)
+            ent_notes = list(_read_ent(ent_file))
         except (FileNotFoundError, PermissionError):
             lg.warning('could not find .ent file, channels have arbitrary '
                        'names')
@@ -1035,44 +1161,33 @@ class Ktlx():
             markers = []
 
         else:
-            allnote = []
-            for n in ent_notes:
+            s_freq = self._hdr['erd']['sample_freq']
+            markers = []
+            for ent_note in ent_notes:
+                n = ent_note['value']
                 try:
-                    n['value'].keys()
-                    allnote.append(n['value'])
+                    n.keys()
                 except AttributeError:
                     lg.debug('Note of length {} was not '
-                             'converted to dict'.format(n['length']))
+                             'converted to dict'.format(ent_note['length']))
+                    continue
 
-            s_freq = self._hdr['erd']['sample_freq']
-            pcname = '0CFEBE72-DA20-4b3a-A8AC-CDD41BFE2F0D'
-            note_time = []
-            note_name = []
-            note_note = []
-            for n in allnote:
                 if n['Text'] == 'Analyzed Data Note':
                     continue
                 if not n['Text']:
                     continue
                 if 'User' not in n['Data'].keys():
                     continue
-                user1 = n['Data']['User'] == 'Persyst'
-                user2 = False  # n['Data']['User'] == 'eeg'
-                user3 = n['Data']['User'] == pcname
-                user4 = n['Data']['User'] == 'XLSpike - Intracranial'
-                user5 = n['Data']['User'] == 'XLEvent - Intracranial'
-                if user1 or user2 or user3 or user4 or user5:
+                user = n['Data']['User']
+                if user in SKIPPED_USERS:
                     continue
-                if len(n['Data']['User']) == 0:
-                    note_name.append('-unknown-')
+                if len(user) == 0:
+                    name = '-unknown-'
                 else:
-                    note_name.append(n['Data']['User'].split()[0])
-                note_time.append(n['Stamp'] / s_freq)
-                note_note.append(n['Text'])
+                    name = user.split()[0]
+                time = n['Stamp'] / s_freq
 
-            markers = []
-            for time, name, note in zip(note_time, note_name, note_note):
-                m = {'name': note + ' (' + name + ')',
+                m = {'name': n['Text'] + ' (' + name + ')',
                      'start': time,
                      'end': time,
                      'chan': None,
@@ -1,23 +1,22 @@
 """Module to convert from electrode to sources using linear matrices
 
 """
-from copy import deepcopy
 from functools import partial
+from hashlib import sha1
 from logging import getLogger
-from multiprocessing import Pool
+from pathlib import Path
 
-from numpy import (arange, asarray, atleast_2d, empty, exp, isnan, NaN,
-                   nansum)
-from numpy.linalg import norm
-try:
-    from scipy.sparse import csr_matrix as sparse
-    # test if csr_matrix is the fastest approach
-except ImportError:
-    sparse = lambda x: x
+from numpy import arange, asarray, bincount, empty, exp, float32, isnan, NaN
+from scipy.sparse import csr_matrix, load_npz, save_npz
+from scipy.spatial import cKDTree
 
 lg = getLogger(__name__)
 
+# increase it when calc_xyz2surf changes, so that old cached files are not used
+XYZ2SURF_VERSION = 1
+
 gauss = lambda x, s: exp(-.5 * (x ** 2 / s ** 2))
+inverse = lambda x, exponent: 1 / (x ** exponent)
 
 
 class Linear:
@@ -26,10 +25,11 @@ class Linear:
     ----
     both hemispheres
     """
-    def __init__(self, surf, chan, threshold=20, exponent=None, std=None):
-        inverse = calc_xyz2surf(surf, chan.return_xyz(), threshold=threshold,
-                                exponent=exponent, std=std)
-        self.inv = sparse(inverse)
+    def __init__(self, surf, chan, threshold=20, exponent=None, std=None,
+                 cache_dir=None):
+        self.inv = calc_xyz2surf(surf, chan.return_xyz(), threshold=threshold,
+                                 exponent=exponent, std=std,
+                                 cache_dir=cache_dir)
         self.chan = chan.return_label()
 
     def __call__(self, data, parameter='chan'):
@@ -39,10 +39,9 @@ class Linear:
         ----
         return_xyz should follow channel order
         """
-        output = deepcopy(data)  # TODO: probably not the best way
+        output = data._copy()  # without copying the data, it's replaced
         del output.axis[parameter]
         output.axis['surf'] = empty(data.number_of('trial'), dtype='O')
-        output.data = empty(data.number_of('trial'), dtype='O')
 
         exclude_vert = ~asarray(self.inv.sum(axis=1)).flatten().astype(bool)
 
@@ -54,7 +53,8 @@ class Linear:
         return output
 
 
-def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None):
+def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None,
+                  cache_dir=None):
     """Calculate transformation matrix from xyz values to vertices.
 
     Parameters
@@ -70,11 +70,16 @@ def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None):
     threshold : float
         distance in mm for a vertex to pick up electrode activity (if distance
         is above the threshold, one electrode does not affect a vertex).
+    cache_dir : path to dir, optional
+        if specified, the matrix is stored in this directory and it's read from
+        there the next time it's computed with the same surface, electrodes
+        and parameters.
 
     Returns
     -------
-    numpy.ndarray
-        nVertices X xyz.shape[0] matrix
+    scipy.sparse.csr_matrix
+        nVertices X xyz.shape[0] matrix (sparse, because each vertex only
+        depends on the few channels close to it), in single precision
 
     Notes
     -----
@@ -94,91 +99,65 @@ def calc_xyz2surf(surf, xyz, threshold=20, exponent=None, std=None):
 
     You can also create your own matrix (and skip calc_xyz2surf altogether) and
     pass it as attribute to the main figure.
-    Because it's a loop over all the vertices, this function is pretty slow,
-    but if you calculate it once, you can reuse it.
-    We take advantage of multiprocessing, which speeds it up considerably.
+    Only the pairs of vertices and channels closer than the threshold are
+    computed (with a k-d tree), because the other ones are zero anyway.
     """
     if exponent is None and std is None:
         exponent = 1
 
+    if cache_dir is not None:
+        cache_file = Path(cache_dir) / ('xyz2surf_' + _hash_xyz2surf(
+            surf, xyz, threshold, exponent, std) + '.npz')
+        if cache_file.exists():
+            lg.debug('Reading xyz2surf from ' + str(cache_file))
+            return load_npz(cache_file)
+
     if exponent is not None:
         lg.debug('Vertex values based on inverse-law, with exponent ' +
                  str(exponent))
-        funct = partial(calc_one_vert_inverse, xyz=xyz, exponent=exponent)
+        funct = partial(inverse, exponent=exponent)
     elif std is not None:
         lg.debug('Vertex values based on gaussian, with s.d. ' + str(std))
-        funct = partial(calc_one_vert_gauss, xyz=xyz, std=std)
-
-    with Pool() as p:
-        xyz2surf = p.map(funct, surf.vert)
-
-    xyz2surf = asarray(xyz2surf)
+        funct = partial(gauss, s=std)
 
     if exponent is not None:
-        threshold_value = (1 / (threshold ** exponent))
-        external_threshold_value = threshold_value
+        external_threshold_value = 1 / (threshold ** exponent)
     elif std is not None:
-        threshold_value = gauss(threshold, std)
         external_threshold_value = gauss(std, std) # this is around 0.607
-    lg.debug('Values thresholded at ' + str(threshold_value))
+    lg.debug('Values thresholded at distance ' + str(threshold))
 
-    xyz2surf[xyz2surf < threshold_value] = NaN
+    # both functions decrease with distance, so thresholding the values is the
+    # same as only using the channels within the threshold distance
+    close = cKDTree(surf.vert).sparse_distance_matrix(cKDTree(xyz), threshold,
+                                                      output_type='ndarray')
+    value = funct(close['v'])
 
     # here we deal with vertices that are within the threshold value but far
     # from a single electrodes, so those remain empty
-    sumval = nansum(xyz2surf, axis=1)
+    sumval = bincount(close['i'], weights=value, minlength=surf.vert.shape[0])
     sumval[sumval < external_threshold_value] = NaN
 
     # normalize by the number of electrodes
-    xyz2surf /= atleast_2d(sumval).T
-    xyz2surf[isnan(xyz2surf)] = 0
-
-    return xyz2surf
+    value /= sumval[close['i']]
+    value[isnan(value)] = 0
 
+    xyz2surf = csr_matrix((value.astype(float32), (close['i'], close['j'])),
+                          shape=(surf.vert.shape[0], xyz.shape[0]))
+    xyz2surf.eliminate_zeros()
 
-def calc_one_vert_inverse(one_vert, xyz=None, exponent=None):
-    """Calculate how many electrodes influence one vertex, using the inverse
-    function.
+    if cache_dir is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        save_npz(cache_file, xyz2surf)
 
-    Parameters
-    ----------
-    one_vert : ndarray
-        vector of xyz position of a vertex
-    xyz : ndarray
-        nChan X 3 with the position of all the channels
-    exponent : int
-        inverse law (1-> direct inverse, 2-> inverse square, 3-> inverse cube)
-
-    Returns
-    -------
-    ndarray
-        one vector with values for one vertex
-    """
-    trans = empty(xyz.shape[0])
-    for i, one_xyz in enumerate(xyz):
-        trans[i] = 1 / (norm(one_vert - one_xyz) ** exponent)
-    return trans
+    return xyz2surf
 
 
-def calc_one_vert_gauss(one_vert, xyz=None, std=None):
-    """Calculate how many electrodes influence one vertex, using a Gaussian
-    function.
+def _hash_xyz2surf(surf, xyz, threshold, exponent, std):
+    """Identify the input of calc_xyz2surf, to store the results."""
+    h = sha1()
+    h.update(str(XYZ2SURF_VERSION).encode())
+    h.update(asarray(surf.vert, dtype='<f8').tobytes())
+    h.update(asarray(xyz, dtype='<f8').tobytes())
+    h.update(repr((threshold, exponent, std)).encode())
+    return h.hexdigest()
 
-    Parameters
-    ----------
-    one_vert : ndarray
-        vector of xyz position of a vertex
-    xyz : ndarray
-        nChan X 3 with the position of all the channels
-    std : float
-        distance in mm of the Gaussian kernel
-
-    Returns
-    -------
-    ndarray
-        one vector with values for one vertex
-    """
-    trans = empty(xyz.shape[0])
-    for i, one_xyz in enumerate(xyz):
-        trans[i] = gauss(norm(one_vert - one_xyz), std)
-    return trans
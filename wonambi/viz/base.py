@@ -5,16 +5,14 @@ from PyQt5.QtWidgets import QApplication
 app = Application('pyqt5')
 
 
-from vispy.scene import SceneCanvas, TurntableCamera
-from vispy.visuals import Visual
-from vispy.scene.visuals import create_visual_node
-from vispy.geometry import create_sphere, MeshData
-from numpy import array, clip, float32, r_
-from vispy.gloo import VertexBuffer
+from vispy.scene import SceneCanvas
+from numpy import clip
 from vispy.io.image import _make_png
 from vispy.gloo.wrappers import read_pixels
 
 COLORMAP = 'coolwarm'
+PNG_PREVIEW_LEVEL = 1  # zlib level, fast for inline plots
+PNG_SAVE_LEVEL = 6  # zlib level, smaller files on disk
 
 
 class Viz(SceneCanvas):
@@ -27,14 +25,20 @@ class Viz(SceneCanvas):
     def _add_mesh(self, mesh):
         self._view.add(mesh)
 
-    def _repr_png_(self):
+    def _repr_png_(self, compress_level=PNG_PREVIEW_LEVEL):
         """This is used by ipython to plot inline.
+
+        Parameters
+        ----------
+        compress_level : int
+            zlib compression level (0-9). Inline plots are thrown away, so
+            it's faster to compress them less.
         """
         app.process_events()
         QApplication.processEvents()
 
         img = read_pixels()
-        return bytes(_make_png(img))
+        return bytes(_make_png(img, level=compress_level))
 
     def save(self, png_file):
         """Save png to disk.
@@ -49,7 +53,7 @@ class Viz(SceneCanvas):
         It relies on _repr_png_, so fix issues there.
         """
         with open(png_file, 'wb') as f:
-            f.write(self._repr_png_())
+            f.write(self._repr_png_(compress_level=PNG_SAVE_LEVEL))
 
 
 def normalize(x, min_value, max_value):
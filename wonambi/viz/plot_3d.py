@@ -1,11 +1,13 @@
 """Module to plot all the elements in 3d space.
 """
-from numpy import (linspace,
+from functools import lru_cache
+
+from numpy import (broadcast_to,
+                   linspace,
                    nanmax,
+                   nanmin,
                    mean,
-                   tile,
                    array,
-                   abs,
                    )
 from vispy.color import get_colormap, ColorArray
 from vispy.geometry import MeshData
@@ -69,8 +71,8 @@ class Viz3(Viz):
 
         # meshdata uses numpy array, in the correct dimension
         vertex_colors = colors.rgba
-        if vertex_colors.shape[0] == 1:
-            vertex_colors = tile(vertex_colors, (surf.n_vert, 1))
+        if vertex_colors.shape[0] == 1:  # read-only view, no copy
+            vertex_colors = broadcast_to(vertex_colors, (surf.n_vert, 4))
 
         meshdata = MeshData(vertices=surf.vert, faces=surf.tri,
                             vertex_colors=vertex_colors)
@@ -170,18 +172,19 @@ def _prepare_colors(color, values, limits_c, colormap, alpha, chan=None):
     """
     if values is not None:
         if limits_c is None:
-            limits_c = array([-1, 1]) * nanmax(abs(values))
+            # no temporary array of absolute values
+            limits_c = array([-1, 1]) * max(nanmax(values), -nanmin(values))
 
         norm_values = normalize(values, *limits_c)
 
-        cm = get_colormap(colormap)
+        cm = _get_colormap(colormap)
         colors = cm[norm_values]
 
     elif color is not None:
         colors = ColorArray(color)
 
     else:
-        cm = get_colormap('hsl')
+        cm = _get_colormap('hsl')
         group_idx = _chan_groups_to_index(chan)
         colors = cm[group_idx]
 
@@ -191,13 +194,23 @@ def _prepare_colors(color, values, limits_c, colormap, alpha, chan=None):
     return colors, limits_c
 
 
+@lru_cache(maxsize=None)
+def _get_colormap(colormap):
+    """Return the vispy colormap, which is only created once per name because
+    some colormaps compute their color table when they are created."""
+    return get_colormap(colormap)
+
+
 def _chan_groups_to_index(chan):
 
     groups = find_channel_groups(chan)
     n_groups = len(groups)
     idx = linspace(0, 1, n_groups)
-    group_idx = chan.return_label()
+
+    # if a label is in more than one group, the first group is used
+    label_idx = {}
     for i, labels in enumerate(groups.values()):
-        group_idx = [idx[i] if label in labels else label for label in group_idx]
+        for label in labels:
+            label_idx.setdefault(label, idx[i])
 
-    return group_idx
+    return [label_idx.get(label, label) for label in chan.return_label()]
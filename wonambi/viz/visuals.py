@@ -1,7 +1,7 @@
 from vispy.visuals import Visual
 from vispy.scene.visuals import create_visual_node
-from numpy import array, float32, r_
-from vispy.gloo import VertexBuffer
+from numpy import float32, uint32
+from vispy.gloo import IndexBuffer, VertexBuffer
 
 VERT_SHADER = """
 #version 120
@@ -38,15 +38,18 @@ class SurfaceMeshVisual(Visual):
     def __init__(self, meshdata):
         Visual.__init__(self, VERT_SHADER, FRAG_SHADER)
 
-        v = meshdata.get_vertices(indexed='faces').astype(float32)
+        # each vertex is stored only once, the faces index into them
+        v = meshdata.get_vertices().astype(float32)
         self._vertices = VertexBuffer(v)
 
-        v_norm = meshdata.get_vertex_normals(indexed='faces').astype(float32)
+        v_norm = meshdata.get_vertex_normals().astype(float32)
         self._normals = VertexBuffer(v_norm)
 
-        v_col = meshdata.get_vertex_colors(indexed='faces').astype(float32)
+        v_col = meshdata.get_vertex_colors().astype(float32)
         self._colors = VertexBuffer(v_col)
 
+        self._index_buffer = IndexBuffer(meshdata.get_faces().astype(uint32))
+
         self.set_light(position=(1., 0., 0.),
                        ambient=.2,
                        diffuse=.8,